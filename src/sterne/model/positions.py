@@ -10,24 +10,44 @@ from model import reflex_motion
 import novas.compat.solsys as solsys
 from novas.compat.eph_manager import ephem_open
 
-def positions(refepoch, epochs, dict_timing, parameter_filter_index, dict_parameters):
+MAS2RAD = (u.mas).to(u.rad)
+
+def positions(refepoch, epochs, dict_timing, parameter_filter_index, dict_parameters, dict_invariants=None,\
+        parameter_names=None):
     """
     Input parameters
     ----------------
     parameter_filter_index : int
         A number (for the pmparin file) used to choose the right paramters for each gaussian distribution.
+    dict_invariants : dict (default : None)
+        The output of calculate_position_invariants(refepoch, epochs, dict_timing).
+        If provided, the parameter-independent part of the model is not re-calculated.
+    parameter_names : list of str (default : None)
+        The output of parameter_names_of_pmparin(dict_parameters, parameter_filter_index).
+        If provided, dict_parameters is not filtered again.
+    """
+    if parameter_names == None:
+        parameter_names = parameter_names_of_pmparin(dict_parameters, parameter_filter_index)
+    Vs = [dict_parameters.get(name, -999) for name in parameter_names] ## auto-filled roots are -999
+    if dict_invariants == None:
+        dict_invariants = calculate_position_invariants(refepoch, np.asarray(epochs, dtype=float), dict_timing)
+    ra_models, dec_models = position_given_invariants(dict_invariants, Vs[0],\
+        Vs[2], Vs[3], Vs[4], Vs[5], Vs[6], Vs[7]) ## all epochs at once
+    return np.concatenate([ra_models, dec_models])
+
+def parameter_names_of_pmparin(dict_parameters, parameter_filter_index):
+    """
+    Return parameters
+    -----------------
+    Ps : list of str
+        Names of the parameters used by the pmparin indexed by parameter_filter_index, in the order of
+        'dec', 'efac', 'incl', 'mu_a', 'mu_d', 'om_asc', 'px', 'ra'. Parameters not inferred for 
+        this pmparin are represented by the bare root name (see auto_fill_disabled_parameters()).
     """
     FP = filter_dictionary_of_parameter_with_index(dict_parameters, parameter_filter_index)
     Ps = list(FP.keys())
     Ps.sort()
-    ra_models = np.array([])
-    dec_models = np.array([])
-    for i in range(len(epochs)):
-        ra_model, dec_model = position(refepoch, epochs[i], FP[Ps[0]],\
-            FP[Ps[2]], FP[Ps[3]], FP[Ps[4]], FP[Ps[5]], FP[Ps[6]], FP[Ps[7]], dict_timing)
-        ra_models = np.append(ra_models, ra_model)
-        dec_models = np.append(dec_models, dec_model)
-    return np.concatenate([ra_models, dec_models])
+    return Ps
 
 def filter_dictionary_of_parameter_with_index(dict_of_parameters, filter_index):
     """
@@ -81,8 +101,8 @@ def position(refepoch, epoch, dec_rad, incl, mu_a, mu_d, om_asc, px, ra_rad,\
         Proper motion in declination, in mas/yr.
     px : float 
         Parallax, in mas.
-    epoch : float
-        Time when a position is to be calculated, in MJD.
+    epoch : float or array of float
+        Time(s) when a position is to be calculated, in MJD.
     dict_of_timing_parameters : dict (default : {})
         In case reflex motion needs to be calculated, dict_of_timing_parameters that
         records orbital parameters obtained with timing should be provided.
@@ -97,15 +117,45 @@ def position(refepoch, epoch, dec_rad, incl, mu_a, mu_d, om_asc, px, ra_rad,\
 
     Return parameters
     -----------------
-    ra_rad : float
+    ra_rad : float (or array of float, if epoch is an array)
         Right ascension for geocentric frame, in rad.
-    dec_rad : float
+    dec_rad : float (or array of float, if epoch is an array)
         Declination for geocentric frame, in rad.
 
     Notes
     -----
     """
-    dT = (epoch - refepoch) * (u.d).to(u.yr) #in yr
+    dict_invariants = calculate_position_invariants(refepoch, epoch, dict_of_timing_parameters)
+    return position_given_invariants(dict_invariants, dec_rad, incl, mu_a, mu_d, om_asc, px, ra_rad)
+
+def calculate_position_invariants(refepoch, epoch, dict_of_timing_parameters={}):
+    """
+    Calculates the part of position() that does not depend on the astrometric parameters,
+    so that it can be computed once for a given set of epochs.
+
+    Return parameters
+    -----------------
+    dict_invariants : dict
+        'dT' - epoch - refepoch (in yr);
+        'earth_position' - X, Y, Z (in AU), see earth_position_in_the_barycentric_frame();
+        'orbital_invariants' - see reflex_motion.calculate_orbital_invariants(),
+            or None if dict_of_timing_parameters is {}.
+    """
+    dict_invariants = {}
+    dict_invariants['dT'] = (epoch - refepoch) * (u.d).to(u.yr) #in yr
+    dict_invariants['earth_position'] = earth_position_in_the_barycentric_frame(epoch)
+    if dict_of_timing_parameters != {}:
+        dict_invariants['orbital_invariants'] = reflex_motion.calculate_orbital_invariants(epoch,\
+            dict_of_timing_parameters)
+    else:
+        dict_invariants['orbital_invariants'] = None
+    return dict_invariants
+
+def position_given_invariants(dict_invariants, dec_rad, incl, mu_a, mu_d, om_asc, px, ra_rad):
+    """
+    position() with the parameter-independent part provided by calculate_position_invariants().
+    """
+    dT = dict_invariants['dT']
     ### proper motion effect ###
     dRA = dT * mu_a / np.cos(dec_rad) # in mas
     dDEC = dT * mu_d #in mas
@@ -113,11 +163,13 @@ def position(refepoch, epoch, dec_rad, incl, mu_a, mu_d, om_asc, px, ra_rad,\
     #dRA, dDEC = np.array([dRA, dDEC])
     offset = np.array([dRA, dDEC]) #in mas
     if px != -999:
-        offset += parallax_related_position_offset_from_the_barycentric_frame(epoch, ra_rad, dec_rad, px) #in mas
-        if (incl != -999) and (om_asc != -999) and (dict_of_timing_parameters != {}):
-            offset += reflex_motion.reflex_motion(epoch, dict_of_timing_parameters, incl, om_asc, px)
-    ra_rad += offset[0] * (u.mas).to(u.rad)
-    dec_rad += offset[1] * (u.mas).to(u.rad)
+        offset += parallax_related_position_offset_given_earth_position(dict_invariants['earth_position'],\
+            ra_rad, dec_rad, px) #in mas
+        if (incl != -999) and (om_asc != -999) and (dict_invariants['orbital_invariants'] != None):
+            offset += reflex_motion.reflex_motion_given_orbital_invariants(dict_invariants['orbital_invariants'],\
+                incl, om_asc, px)
+    ra_rad += offset[0] * MAS2RAD
+    dec_rad += offset[1] * MAS2RAD
     return  ra_rad, dec_rad #rad
 
 def model_parallax_and_reflex_motion_offset(epoch, dict_parameters, dict_of_timing_parameters, no_px):
@@ -264,7 +316,7 @@ def parallax_related_position_offset_from_the_barycentric_frame(epoch, ra, dec,
     
     Input parameters
     ----------------
-    epoch : float
+    epoch : float or array of float
         in MJD.
     ra : float
         in rad.
@@ -276,9 +328,9 @@ def parallax_related_position_offset_from_the_barycentric_frame(epoch, ra, dec,
     Return parameters
     -----------------
     np.array([dRA, dDEC])
-        dRA : float
+        dRA : float (or array of float, if epoch is an array)
             Right asension offset, in mas.
-        dDEC : float
+        dDEC : float (or array of float, if epoch is an array)
             Declination offset, in mas.
 
     References
@@ -286,6 +338,34 @@ def parallax_related_position_offset_from_the_barycentric_frame(epoch, ra, dec,
     1. Explanatory Supplement to Astronomical Almanac.
     2. NOVAS
     """
+    # This is the Earth position in X, Y, Z (AU) in ICRS wrt SSB 
+    earth_position = earth_position_in_the_barycentric_frame(epoch)
+    return parallax_related_position_offset_given_earth_position(earth_position, ra, dec, px)
+
+def parallax_related_position_offset_given_earth_position(earth_position, ra, dec, px):
+    """
+    parallax_related_position_offset_from_the_barycentric_frame() with the Earth position 
+    (X, Y, Z in AU, see earth_position_in_the_barycentric_frame()) provided.
+    """
+    X, Y, Z = earth_position
+    #print(X,Y,Z)
+    # Following is from Astronomical Almanac Explanatory Supplement p 125-126
+    dRA = px * (X * np.sin(ra) - Y * np.cos(ra)) / np.cos(dec) #in mas; here, np.cos(dec) has been divided, to be added to ra_rad
+    dDEC = px * (X * np.cos(ra) * np.sin(dec) + Y * np.sin(ra) * np.sin(dec) - Z * np.cos(dec)) #in mas
+    return np.array([dRA, dDEC]) #in mas
+
+def earth_position_in_the_barycentric_frame(epoch):
+    """
+    Input parameters
+    ----------------
+    epoch : float or array of float
+        in MJD.
+
+    Return parameters
+    -----------------
+    X, Y, Z : float (or array of float, if epoch is an array)
+        Earth position (in AU) in ICRS with respect to the solar system barycenter.
+    """
     #if not useDE421:
     #    ephem_open()
     #else:
@@ -294,13 +374,10 @@ def parallax_related_position_offset_from_the_barycentric_frame(epoch, ra, dec,
         print('\nTEMPO2 not installed or its environment variable unset; aborting...') ## it does not need to be installed, but the T2runtime folder is needed.
         sys.exit(1)
     ephem_open(os.path.join(os.getenv("TEMPO2"), "T2runtime/ephemeris/DE421.1950.2050"))
-    # This is the Earth position in X, Y, Z (AU) in ICRS wrt SSB 
-    X, Y, Z = solsys.solarsystem(epoch+2400000.5, 3, 0)[0]  
-    #print(X,Y,Z)
-    # Following is from Astronomical Almanac Explanatory Supplement p 125-126
-    dRA = px * (X * np.sin(ra) - Y * np.cos(ra)) / np.cos(dec) #in mas; here, np.cos(dec) has been divided, to be added to ra_rad
-    dDEC = px * (X * np.cos(ra) * np.sin(dec) + Y * np.sin(ra) * np.sin(dec) - Z * np.cos(dec)) #in mas
-    return np.array([dRA, dDEC]) #in mas
+    if np.ndim(epoch) == 0:
+        return solsys.solarsystem(epoch+2400000.5, 3, 0)[0]
+    XYZs = np.array([solsys.solarsystem(each_epoch+2400000.5, 3, 0)[0] for each_epoch in epoch])
+    return XYZs.reshape(-1, 3).T
 
 def plot_model_given_astrometric_parameters(refepoch, ra, dec, mu_a, mu_d, px, start_epoch, end_epoch,\
         useDE421=True, inputgeocentricposition=False):
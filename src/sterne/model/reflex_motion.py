@@ -6,9 +6,12 @@ import numpy as np
 import astropy.units as u
 from astropy import constants
 import os, sys
+import copy
+from functools import lru_cache
 import others
 from psrqpy import QueryATNF
 import priors
+import simulate
 from shutil import which
 
 def generate_parfile(pulsar):
@@ -32,6 +35,16 @@ def generate_parfile(pulsar):
 
 def read_parfile(parfile):
     """
+    The parsed parameters are cached until parfile is modified; a copy is returned each time.
+    See _read_parfile_cached() for the details.
+    """
+    return copy.deepcopy(_read_parfile_cached(*others.file_cache_key(parfile)))
+
+@lru_cache(maxsize=None)
+def _read_parfile_cached(parfile, mtime_ns, size):
+    """
+    parfile is the real path of the file; mtime_ns and size are only used as part of the cache key.
+
     Note
     ----
     For pulsars listed in PSRCAT, parfile can be made with generate_parfile.
@@ -114,13 +127,13 @@ def solve_u(e, c, precision=1e-5):
 
     Return parameters
     -----------------
-    u : float
+    u : float (or array of float, if c is an array)
     iterations : int
     """
     x = c/(1-e) #first order approximation: sin(u) = u
     x1 = float('inf')
     iterations = 0
-    while abs(x - x1) > precision:
+    while np.max(np.abs(x - x1)) > precision:
         x1 = x
         x = e * np.sin(x1) + c
         iterations += 1
@@ -141,7 +154,7 @@ def reflex_motion(epoch, dict_of_orbital_parameters, incl, Om_asc, px):
 
     Input paramters
     ---------------
-    epoch : float
+    epoch : float or array of float
         in MJD.
     dict_of_orbital_parameters : dict
         See the function read_parfile()
@@ -154,10 +167,10 @@ def reflex_motion(epoch, dict_of_orbital_parameters, incl, Om_asc, px):
 
     Return parameters
     -----------------
-    dRA : float
+    dRA : float (or array of float, if epoch is an array)
         Reflex-motion-related right ascension offset (in mas), corresponding to the vector e1
         in Eqn 54.
-    dDEC : float
+    dDEC : float (or array of float, if epoch is an array)
         Reflex-motion-related declination offset (in mas), corresponding to the vector e2
         in Eqn 54.
 
@@ -165,10 +178,30 @@ def reflex_motion(epoch, dict_of_orbital_parameters, incl, Om_asc, px):
     ---------
     1. Edwards, Hobbs and Manchester 2006 (2006MNRAS.372.1549E). 
     """
+    orbital_invariants = calculate_orbital_invariants(epoch, dict_of_orbital_parameters)
+    return reflex_motion_given_orbital_invariants(orbital_invariants, incl, Om_asc, px)
+
+def calculate_orbital_invariants(epoch, dict_of_orbital_parameters):
+    """
+    The part of reflex_motion() that only depends on the epoch(s) and the timing parameters,
+    which can hence be computed once and re-used for any incl, Om_asc and px.
+
+    Input paramters
+    ---------------
+    epoch : float or array of float
+        in MJD.
+    dict_of_orbital_parameters : dict
+        See the function read_parfile()
+
+    Return parameters
+    -----------------
+    orbital_invariants : dict
+        'b_AU' - distance (in AU) between the pulsar and the barycenter of the binary;
+        'cos_theta', 'sin_theta' - cosine and sine of the orbital phase theta (Eqn 55);
+        'cos_dec' - cosine of the declination of the pulsar.
+    """
     DoP = dict_of_orbital_parameters
-    epoch *= u.d
-    incl *= u.rad
-    Om_asc *= u.deg
+    epoch = epoch * u.d ## not in place, as epoch can be an array owned by the caller
     e, T0, Pb0, omega0, a0, dec = DoP['ecc'], DoP['t0'],\
         DoP['pb'], DoP['om'], DoP['a1'], DoP['decj']
     try:
@@ -197,20 +230,44 @@ def reflex_motion(epoch, dict_of_orbital_parameters, incl, Om_asc, px):
     else:
         a1 = a0
     b_abs = a1 * (1 - e * np.cos(u1))
-    b_AU = b_abs.to(u.AU).value
-    offset = b_AU * px
-    matr1 = np.mat([[np.sin(Om_asc), -np.cos(Om_asc), 0],
-                    [np.cos(Om_asc), np.sin(Om_asc), 0],
-                    [0, 0, 1]])
-    matr2 = np.mat([[1, 0, 0],
-                    [0, -np.cos(incl), -np.sin(incl)],
-                    [0, np.sin(incl), -np.cos(incl)]])
-    matr3 = np.mat([[offset*np.cos(theta)],
-                    [offset*np.sin(theta)],
-                    [0]])
-    b = matr1 * matr2 * matr3
-    dRA = (b.item(0,0)/np.cos(dec)).value #that can be directly added to RA
-    dDEC = b.item(1,0)
+    orbital_invariants = {}
+    orbital_invariants['b_AU'] = b_abs.to(u.AU).value
+    orbital_invariants['cos_theta'] = np.cos(theta).value
+    orbital_invariants['sin_theta'] = np.sin(theta).value
+    orbital_invariants['cos_dec'] = np.cos(dec).value
+    return orbital_invariants
+
+def reflex_motion_given_orbital_invariants(orbital_invariants, incl, Om_asc, px):
+    """
+    Input paramters
+    ---------------
+    orbital_invariants : dict
+        See the function calculate_orbital_invariants().
+    incl : float
+        Inclination angle (rad).
+    Om_asc : float
+        Position angle of ascending node (deg).
+    px : float
+        Parallax (mas).
+
+    Return parameters
+    -----------------
+    np.array([dRA, dDEC]) : see reflex_motion().
+    """
+    OI = orbital_invariants
+    Om_asc_rad = Om_asc * np.pi/180.
+    offset = OI['b_AU'] * px
+    ## the first two rows of matr1 * matr2 * matr3, written out so that epoch can be an array, where
+    ## matr1 = [[sin(Om_asc), -cos(Om_asc), 0], [cos(Om_asc), sin(Om_asc), 0], [0, 0, 1]],
+    ## matr2 = [[1, 0, 0], [0, -cos(incl), -sin(incl)], [0, sin(incl), -cos(incl)]],
+    ## matr3 = [[offset*cos(theta)], [offset*sin(theta)], [0]].
+    sin_Om_asc, cos_Om_asc = np.sin(Om_asc_rad), np.cos(Om_asc_rad)
+    cos_incl = np.cos(incl)
+    cos_theta, sin_theta = OI['cos_theta'], OI['sin_theta']
+    b0 = offset * (sin_Om_asc * cos_theta + cos_Om_asc * cos_incl * sin_theta)
+    b1 = offset * (cos_Om_asc * cos_theta - sin_Om_asc * cos_incl * sin_theta)
+    dRA = b0 / OI['cos_dec'] #that can be directly added to RA
+    dDEC = b1
     return np.array([dRA, dDEC]) #in mas
 
 
@@ -258,9 +315,10 @@ class reflex_motion_detectability:
         if not os.path.exists(pmparin):
             print('%s does not exist; aborting' % pmparin)
             sys.exit(1)
-        pmparout = pmparin.replace('pmpar.in','pmpar.out')
-        os.system("pmpar %s > %s" % (pmparin, pmparout))
-        [ra, error_ra, dec, error_dec, mu_a, error_mu_a, mu_d, error_mu_d, px, err_px, rcs, junk] = priors.readpmparout(pmparout)
+        ## px, err_px and rcs do not depend on the reference epoch, so the mean epoch is used
+        refepoch = np.mean(simulate.readpmparin(pmparin)['epoch'])
+        [ra, error_ra, dec, error_dec, mu_a, error_mu_a, mu_d, error_mu_d, px, err_px, rcs, junk] =\
+            priors.fit_astrometric_parameters_with_pmparin(refepoch, pmparin)
         
         try:
             a1 = kwargs['a1']
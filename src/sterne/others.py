@@ -66,12 +66,23 @@ def dms2deg(array):
     if type(array)==str:
         degrees = dms_str2deg(array)
     else:
-        degrees = np.array([])
-        for string in array:
-            degree = dms_str2deg(string)
-            degrees = np.append(degrees, degree)
+        degrees = np.fromiter(map(dms_str2deg, array), dtype=float) ## one allocation instead of np.append per row
     return degrees
 
+def dms2deg_vec(array):
+    """
+    Vectorized dms2deg() for an array of strings all in the 'dd:mm:ss.ssss' format,
+    which converts whole columns at once instead of parsing the strings one by one.
+    Arrays in any other format are passed on to dms2deg().
+    """
+    array = np.char.strip(np.asarray(array, dtype=str))
+    try:
+        dmss = np.array(np.char.split(array, ':').tolist(), dtype=float).reshape(len(array), 3)
+    except ValueError:
+        return dms2deg(array)
+    signs = np.where(np.char.startswith(array, '-'), -1., 1.) ## also right for '-00:mm:ss'
+    return signs * ((dmss[:,2]/60 + dmss[:,1])/60 + np.abs(dmss[:,0]))
+
 def shift_position(RA, Dec, RA_shift, Dec_shift):
     """
     Functionality
@@ -440,3 +451,10 @@ def no_alphabet(str):
             break
     return no_alphabet
 
+def file_cache_key(filename):
+    """
+    Key for caching what is parsed from filename, i.e. (real absolute path, modification time in ns, size).
+    Unlike the path as passed, it tells apart same-named files in different directories.
+    """
+    status = os.stat(filename)
+    return os.path.realpath(filename), status.st_mtime_ns, status.st_size
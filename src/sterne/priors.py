@@ -6,7 +6,8 @@ The main code to run is generate_initsfile().
 import numpy as np
 import astropy.units as u
 from astropy import constants
-import os, sys
+import os, sys, re
+from functools import lru_cache
 import others
 import simulate
 import bilby
@@ -47,13 +48,20 @@ def generate_initsfile(refepoch, pmparins, shares, HowManySigma=20, **kwargs):
             EFAC is used to find appropriate systematics following the relation:
             err_new**2 = err_random**2 + (EFAC * err_sys_old)**2.
             Here, the EFAC_prior would apply to all EFACs.
+        4) list_of_dict_VLBI : list of dict (default : None)
+            The parsed pmparins, as made by simulate.create_list_of_dict_VLBI(pmparins).
+            If provided, the pmparins are not read again.
     """
     if type(pmparins) != list:
         print('pmparins has to be a list. Exiting for now.')
         sys.exit(1)
     HMS = HowManySigma
     roots = ['dec', 'mu_a', 'mu_d', 'px', 'ra']
-    dict_limits = create_dictionary_of_boundaries_with_pmpar(refepoch, pmparins, HowManySigma)
+    try:
+        list_of_dict_VLBI = kwargs['list_of_dict_VLBI']
+    except KeyError:
+        list_of_dict_VLBI = None
+    dict_limits = create_dictionary_of_boundaries_with_pmpar(refepoch, pmparins, HowManySigma, list_of_dict_VLBI)
     parameters = get_parameters_from_shares(shares)
     try:
         incl_prior = kwargs['incl_prior']
@@ -74,7 +82,7 @@ def generate_initsfile(refepoch, pmparins, shares, HowManySigma=20, **kwargs):
     writefile.write('#%d reduced-chi-squre-corrected sigma limits are used.\n' % HMS)
     writefile.write('#If Uniform or Sine distribution is requested, then the two values stand for lower and upper limit.\n')
     writefile.write('#If Gaussian distribution is requested, then the two values stand for mu and sigma.\n')
-    writefile.write('#The Uniform prior info is based on the pmpar results.\n')
+    writefile.write('#The Uniform prior info is based on least-squares fits of the pmpar.in files.\n')
     writefile.write('#Units: dec and ra in rad; px in mas; mu_a and mu_d in mas/yr; incl in rad; om_asc in deg.\n')
     writefile.write('#parameter name explained: dec_0_1, for example, means this dec parameter is inferred for both pmparin0 and pmparin1.\n')
     for parameter in parameters.keys():
@@ -92,44 +100,38 @@ def generate_initsfile(refepoch, pmparins, shares, HowManySigma=20, **kwargs):
             pass
     writefile.close()
 
-def create_dictionary_of_boundaries_with_pmpar(refepoch, pmparins, HowManySigma=20):
+def create_dictionary_of_boundaries_with_pmpar(refepoch, pmparins, HowManySigma=20, list_of_dict_VLBI=None):
     """
     do not cover 'incl' and 'om_asc'.
+    The astrometric parameters are fitted with fit_astrometric_parameters(),
+    which replaces the former pmpar run (and the pmpar.out files).
+    If list_of_dict_VLBI (see simulate.create_list_of_dict_VLBI()) is provided, it is used 
+    instead of reading pmparins again.
     """
     HMS = HowManySigma
     roots = ['dec', 'mu_a', 'mu_d', 'px', 'ra']
-    dec_lows, dec_ups, mu_a_lows, mu_a_ups, mu_d_lows, mu_d_ups,\
-        px_lows, px_ups, ra_lows, ra_ups = [], [], [], [], [],\
-        [],[],[],[],[]
+    dict_limits = {}
+    for root in roots:
+        dict_limits[root] = {'low': [], 'up': []}
     for i in range(len(pmparins)):
-        pmparout = pmparins[i].replace('pmpar.in','pmpar.out')
-        replace_pmparin_refepoch(pmparins[i], refepoch)
-        os.system("pmpar %s > %s" % (pmparins[i], pmparout))
-        [ra, error_ra, dec, error_dec, mu_a, error_mu_a, mu_d, error_mu_d, px, error_px, rchsq, junk] = readpmparout(pmparout)
+        if list_of_dict_VLBI != None:
+            VLBI_dict = list_of_dict_VLBI[i]
+            [ra, error_ra, dec, error_dec, mu_a, error_mu_a, mu_d, error_mu_d, px, error_px, rchsq, junk] =\
+                fit_astrometric_parameters(refepoch, VLBI_dict['epochs'], VLBI_dict['radecs'], VLBI_dict['errs'])
+        else:
+            [ra, error_ra, dec, error_dec, mu_a, error_mu_a, mu_d, error_mu_d, px, error_px, rchsq, junk] =\
+                fit_astrometric_parameters_with_pmparin(refepoch, pmparins[i])
         errors = np.array([error_ra, error_dec, error_mu_a, error_mu_d, error_px])
         print(errors, rchsq)
         errors *= rchsq**0.5
         print(errors)
         error_ra, error_dec, error_mu_a, error_mu_d, error_px = errors
-        dec_lows.append(dec - HMS * error_dec)
-        dec_ups.append(dec + HMS * error_dec)
-        mu_a_lows.append(mu_a - HMS * error_mu_a)
-        mu_a_ups.append(mu_a + HMS * error_mu_a)
-        mu_d_lows.append(mu_d - HMS * error_mu_d)
-        mu_d_ups.append(mu_d + HMS * error_mu_d)
-        px_lows.append(px - HMS * error_px)
-        px_ups.append(px + HMS * error_px)
-        ra_lows.append(ra - HMS * error_ra)
-        ra_ups.append(ra + HMS * error_ra)
-    dec_limits, mu_a_limits, mu_d_limits, px_limits, ra_limits = {},{},{},{},{}
-    dec_limits['low'], dec_limits['up'] = dec_lows, dec_ups
-    mu_a_limits['low'], mu_a_limits['up'] = mu_a_lows, mu_a_ups
-    mu_d_limits['low'], mu_d_limits['up'] = mu_d_lows, mu_d_ups
-    px_limits['low'], px_limits['up'] = px_lows, px_ups
-    ra_limits['low'], ra_limits['up'] = ra_lows, ra_ups
-    dict_limits = {}
-    for root in roots:
-        exec("dict_limits[root] = %s_limits" % root)
+        estimates = {'dec': (dec, error_dec), 'mu_a': (mu_a, error_mu_a), 'mu_d': (mu_d, error_mu_d),\
+            'px': (px, error_px), 'ra': (ra, error_ra)}
+        for root in roots:
+            value, error = estimates[root]
+            dict_limits[root]['low'].append(value - HMS * error)
+            dict_limits[root]['up'].append(value + HMS * error)
     return dict_limits
     
 
@@ -150,6 +152,11 @@ def parameter_name_to_pmparin_indice(string):
     Example :
         input 'mu_a_0_2_3' --> out: ([0,2,3], 'mu_a')
     """
+    pmparin_indice, parameter_root = _parameter_name_to_pmparin_indice_cached(string)
+    return list(pmparin_indice), parameter_root
+
+@lru_cache(maxsize=None)
+def _parameter_name_to_pmparin_indice_cached(string):
     alist = string.split('_')
     pmparin_indice = []
     parameter_root = []
@@ -159,67 +166,125 @@ def parameter_name_to_pmparin_indice(string):
         except ValueError:
             parameter_root.append(element)
     parameter_root = '_'.join(parameter_root)
-    return pmparin_indice, parameter_root
+    return tuple(pmparin_indice), parameter_root
+
+def fit_astrometric_parameters_with_pmparin(refepoch, pmparin):
+    """
+    fit_astrometric_parameters() applied to the positions in pmparin.
+    """
+    t = simulate.readpmparin(pmparin)
+    radecs = np.concatenate([t['RA'], t['DEC']])
+    errs = np.concatenate([t['errRA'], t['errDEC']])
+    return fit_astrometric_parameters(refepoch, np.asarray(t['epoch']), radecs, errs)
+
+def fit_astrometric_parameters(refepoch, epochs, radecs, errs):
+    """
+    Weighted linear least-squares fit of position, proper motion and parallax to the positions,
+    i.e. what pmpar does, but without spawning pmpar or parsing its output.
+    The parallax factors are calculated at the weighted-mean position.
+
+    Input parameters
+    ----------------
+    refepoch : float
+        Reference epoch (MJD), at which ra and dec are fitted.
+    epochs : array of float
+        in MJD.
+    radecs : array of float
+        RAs followed by DECs (in rad), see simulate.create_list_of_dict_VLBI().
+    errs : array of float
+        Errors of radecs (in rad).
+
+    Return parameters
+    -----------------
+    ra, error_ra : float
+        Fitted RA at refepoch and its error (both in rad).
+    dec, error_dec : float
+        Fitted DEC at refepoch and its error (both in rad).
+    mu_a, error_mu_a, mu_d, error_mu_d : float
+        Proper motion in RA (including the cos(dec) factor) and DEC, and their errors (all in mas/yr).
+    px, error_px : float
+        Parallax and its error (both in mas).
+    rchsq : float
+        Reduced chi-square of the fit. The errors above are not scaled by rchsq.
+    refepoch : float
+        The input reference epoch (MJD).
+    """
+    from model.positions import parallax_related_position_offset_from_the_barycentric_frame, MAS2RAD
+    epochs = np.asarray(epochs, dtype=float)
+    NoE = len(epochs)
+    RAs, DECs = np.asarray(radecs[:NoE]), np.asarray(radecs[NoE:])
+    errRAs, errDECs = np.asarray(errs[:NoE]), np.asarray(errs[NoE:])
+    if NoE < 3:
+        print('At least 3 epochs are needed to fit for 5 parameters. Exiting for now.')
+        sys.exit(1)
+    ra_ref = np.average(RAs, weights=errRAs**-2)
+    dec_ref = np.average(DECs, weights=errDECs**-2)
+    dT = (epochs - refepoch) * (u.d).to(u.yr) #in yr
+    px_factors_ra, px_factors_dec = parallax_related_position_offset_from_the_barycentric_frame(epochs,\
+        ra_ref, dec_ref, 1.) #in mas per mas of parallax
+    ## >>> design matrix of [ra_offset, dec_offset, mu_a, mu_d, px] in mas, RA rows before DEC rows
+    A = np.zeros((2*NoE, 5))
+    A[:NoE, 0] = 1.
+    A[:NoE, 2] = dT / np.cos(dec_ref)
+    A[:NoE, 4] = px_factors_ra
+    A[NoE:, 1] = 1.
+    A[NoE:, 3] = dT
+    A[NoE:, 4] = px_factors_dec
+    ## <<<
+    y = np.concatenate([RAs - ra_ref, DECs - dec_ref]) / MAS2RAD #in mas
+    errs = np.concatenate([errRAs, errDECs]) / MAS2RAD #in mas
+    Aw, yw = A / errs[:, None], y / errs
+    solution, chi_sq, rank, junk = np.linalg.lstsq(Aw, yw, rcond=None)
+    covariance = np.linalg.inv(Aw.T @ Aw)
+    errors = np.sqrt(np.diag(covariance))
+    res_w = yw - Aw @ solution
+    rchsq = np.dot(res_w, res_w) / (2*NoE - 5)
+    ra = ra_ref + solution[0] * MAS2RAD
+    dec = dec_ref + solution[1] * MAS2RAD
+    return ra, errors[0] * MAS2RAD, dec, errors[1] * MAS2RAD, solution[2], errors[2],\
+        solution[3], errors[3], solution[4], errors[4], rchsq, float(refepoch)
 
 def readpmparout(pmparout):
     """
-    The function serves to offer priors for the simulation.
+    Parse the output of pmpar. The priors no longer rely on pmpar (see fit_astrometric_parameters()),
+    so this is only kept as a utility.
+
+    Return parameters
+    -----------------
+    RA, error_RA, Dec, error_Dec (all in rad), mu_a, error_mu_a, mu_d, error_mu_d (all in mas/yr),
+    pi, error_pi (both in mas), rchsq, epoch (in MJD).
     """
     rchsq = 0
-    lines = open(pmparout).readlines()
-    for line in lines:
+    values, errors = {}, {} ## for 'mu_a', 'mu_d' and 'pi'
+    with open(pmparout, 'r') as readfile:
+        lines = readfile.read().splitlines()
+    for line in lines: ## values and errors are collected in the same pass
         if 'epoch' in line:
             epoch = line.split('=')[1].strip()
         if 'Reduced' in line:
             rchsq = float(line.split('=')[1].strip())
         for estimate in ['mu_a', 'mu_d', 'pi']:
             if estimate in line:
-                #globals()['line'] = line
-                #string = ("%s = " % estimate.strip())
-                value = line.split('=')[-1].split('+')[0].strip()
-                #print(value)
-                #print(estimate.strip())
-                exec("%s='%s'" % (estimate.strip(), value), globals())
-        if 'RA' in line: #here, due to a bug in exec(), it is not combined with the other three parameters
+                values[estimate] = line.split('=')[-1].split('+')[0].strip()
+                errors[estimate] = float(line.split('+-')[1].strip().split(' ')[0])
+        if 'RA' in line:
             RA = line.split('=')[-1].split('+')[0].strip()
             RA = others.dms2deg(RA)
+            error_RA = float(line.split('+-')[1].strip().split(' ')[0])
         if 'Dec  ' in line:
             Dec = line.split('=')[-1].split('+')[0].strip()
             Dec = others.dms2deg(Dec)
-
-    for line in lines:
-        if 'RA' in line:
-            error_RA = float(line.split('+-')[1].strip().split(' ')[0])
-        if 'Dec  ' in line:
             error_Dec = float(line.split('+-')[1].strip().split(' ')[0])
-        for estimate in ['mu_a', 'mu_d', 'pi']:
-            if estimate in line:
-                error = line.split('+-')[1].strip().split(' ')[0]
-                exec("error_%s = %s" % (estimate.strip(), error), globals())
-                #exec("print(error_%s)" % estimate)
-                exec("%s = float(%s)" % (estimate.strip(), estimate.strip()), globals())
     RA *= 15 * np.pi/180. #rad
     Dec *= np.pi/180. #rad
     error_RA *= 15 * np.pi/180./3600. #rad
     error_Dec *= np.pi/180./3600. #rad
+    mu_a, mu_d, pi = [float(values[estimate]) for estimate in ['mu_a', 'mu_d', 'pi']]
+    error_mu_a, error_mu_d, error_pi = [errors[estimate] for estimate in ['mu_a', 'mu_d', 'pi']]
     return RA, error_RA, Dec, error_Dec, mu_a, error_mu_a, mu_d, error_mu_d, pi, error_pi, rchsq, float(epoch)
     
 
 
-def replace_pmparin_refepoch(pmparin, refepoch):
-    """
-    refepoch in MJD
-    """
-    readfile = open(pmparin, 'r')
-    lines = readfile.readlines()
-    for i in range(len(lines)):
-        if 'epoch' in lines[i] and (not lines[i].strip().startswith('#')):
-            lines[i] = 'epoch = ' + str(refepoch) + '\n'
-    readfile.close()
-    writefile = open(pmparin, 'w')
-    writefile.writelines(lines)
-    writefile.close()
-
 class __Sine_deg(Prior):
     """
     Note
@@ -255,6 +320,14 @@ class __Sine_deg(Prior):
         return _cdf
 
 def get_parameters_from_shares(shares):
+    """
+    The results are cached by the values of shares; a new dict is returned each time.
+    """
+    shares_tuple = tuple(tuple(int(element) for element in row) for row in shares)
+    return dict(_get_parameters_from_shares_cached(shares_tuple))
+
+@lru_cache(maxsize=None)
+def _get_parameters_from_shares_cached(shares):
     parameters = {}
     roots = parameter_roots = ['dec', 'efac', 'incl', 'mu_a', 'mu_d', 'om_asc', 'px', 'ra']
     NoP = number_of_pmparins = len(shares[0])
@@ -277,20 +350,19 @@ def group_elements_by_same_values(alist):
     """
     LoS = list_of_string = []
     alist = np.array(alist)
-    GEI = grouped_element_indice = []
-    N = len(alist)
-    for i in range(len(alist)):
-        if (not i in GEI) and (alist[i]>=0):
-            each_group = np.where(alist==alist[i])[0]
-            each_group = each_group.tolist()
-            GEI += each_group
-            each_group.sort()
+    values, first_indice, inverse = np.unique(alist, return_index=True, return_inverse=True)
+    for k in np.argsort(first_indice): ## keep the groups in the order of their first appearance
+        if values[k] >= 0:
+            each_group = np.where(inverse.ravel()==k)[0]
             each_group = [str(element) for element in each_group]
             str_of_group = '_' + '_'.join(each_group)
             LoS.append(str_of_group)
     return LoS
 
 
+## e.g. 'mu_a_0_1: 1.2,3.4,Uniform' --> ('mu_a_0_1', ' 1.2,3.4,Uniform')
+INITS_LINE_PATTERN = re.compile(r'^\s*((?:ra|dec|mu_a|mu_d|px|incl|om_asc|efac)(?:_\d+)*)\s*:([^:]*)$')
+
 def read_inits(initsfile):
     """
     the additional constraints should be given in the same parameter line after the likelihood distribution requests.
@@ -300,33 +372,33 @@ def read_inits(initsfile):
     DoD_additional_constraints : dict of 2 dict
     """
     #initsfile = pmparin.replace('pmpar.in', 'inits')
-    readfile = open(initsfile, 'r')
-    lines = readfile.readlines()
-    readfile.close()
     dict_limits = {}
     DoD_additional_constraints = dict_of_dict_additional_constraints = {}
     DoD_additional_constraints['sin_incl_Gaussian_constraints'] = {}
     DoD_additional_constraints['sin_incl_limits_constraints'] = {}
-    for line in lines:
-        if not line.startswith('#'):
-            for keyword in ['ra', 'dec', 'mu_a', 'mu_d', 'px', 'incl', 'om_asc', 'efac']:
-                if keyword in line:
-                    parameter = line.split(':')[0].strip()
-                    limits = line.split(':')[-1].strip().split(',')
-                    limits = [limit.strip() for limit in limits]
-                    limits[0] = float(limits[0])
-                    limits[1] = float(limits[1])
-                    dict_limits[parameter] = limits[:3]
-                    
-                    try:
-                        limits[3] = float(limits[3]) ## additional constraints
-                        limits[4] = float(limits[4])
-                        if (limits[5] == 'Sine_Gaussian') and ('incl' in parameter):
-                            DoD_additional_constraints['sin_incl_Gaussian_constraints'][parameter] = limits[3:5]
-                        elif (limits[5] == 'Sine_limits') and ('incl' in parameter):
-                            DoD_additional_constraints['sin_incl_limits_constraints'][parameter] = limits[3:5]
-                    except IndexError:
-                        pass
+    with open(initsfile, 'r') as readfile:
+        for line in readfile:
+            if line.startswith('#'):
+                continue
+            matched = INITS_LINE_PATTERN.match(line) ## one regex match per line, instead of 8 substring tests
+            if matched == None:
+                continue
+            parameter = matched.group(1)
+            limits = matched.group(2).strip().split(',')
+            limits = [limit.strip() for limit in limits]
+            limits[0] = float(limits[0])
+            limits[1] = float(limits[1])
+            dict_limits[parameter] = limits[:3]
+            
+            try:
+                limits[3] = float(limits[3]) ## additional constraints
+                limits[4] = float(limits[4])
+                if (limits[5] == 'Sine_Gaussian') and ('incl' in parameter):
+                    DoD_additional_constraints['sin_incl_Gaussian_constraints'][parameter] = limits[3:5]
+                elif (limits[5] == 'Sine_limits') and ('incl' in parameter):
+                    DoD_additional_constraints['sin_incl_limits_constraints'][parameter] = limits[3:5]
+            except IndexError:
+                pass
     return dict_limits, DoD_additional_constraints
 
 
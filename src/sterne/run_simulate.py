@@ -25,6 +25,12 @@ parser.add_argument("-i", "--iterations", dest="iterations", type=int,
                     default=1000, metavar="iterations", help="the depths that random walkers cover")
 parser.add_argument("-n", "--nwalkers", dest="nwalkers", type=int, default=30,
                     metavar="nwalkers", help="the number of random walkers")
+parser.add_argument("-p", "--nprocesses", dest="nprocesses", type=int, default=1,
+                    metavar="nprocesses", help="the number of processes to evaluate the likelihood with")
+parser.add_argument("-S", "--sampler", dest="sampler", type=str, default='emcee',
+                    metavar="sampler", help="the sampler passed to bilby.run_sampler, e.g. emcee, dynesty or ultranest")
+parser.add_argument("-l", "--nlive", dest="nlive", type=int, default=300,
+                    metavar="nlive", help="the number of live points, for nested samplers such as dynesty")
 parser.add_argument("-a", "--a1dot", dest="a1dot_constraints", type=str, 
                     default=False, metavar="a1dot_constraints", 
                     help="a1dot constraints, a list of list of 2 floats. e.g. [[mu, sigma], []], (both in lt-sec/sec), where mu and sigma refers to the Gaussian distribution for a1dot. The length of a1dot_constraint needs to match len(pmparins), unless None.")
@@ -33,23 +39,27 @@ parser.add_argument("-o", "--outdir", dest="outdir", type=str, default='outdir',
 parser.add_argument("-c", "--clearoutdir", dest="clearoutdir", default='False', 
                     action="store_true", help="clear outdir")
 
-options         = parser.parse_args()
-refepoch        = options.epoch
-initsfiles      = options.priors
-pmparins        = options.pmparins
-clearoutdir     = options.clearoutdir
+if __name__ == '__main__':
+    options         = parser.parse_args()
+    refepoch        = options.epoch
+    initsfiles      = options.priors
+    pmparins        = options.pmparins
+    clearoutdir     = options.clearoutdir
 
-kwargs = {}
-kwargs['iterations'] = options.iterations
-kwargs['nwalkers'] = options.nwalkers
-kwargs['pmparin_preliminaries'] = options.prelimpmpars
-kwargs['outdir'] = options.outdir
-exec("kwargs['shares'] = %s" % options.shares)
-exec("kwargs['a1dot_constraints'] = %s" % options.a1dot_constraints)
-print(kwargs)
+    kwargs = {}
+    kwargs['iterations'] = options.iterations
+    kwargs['nwalkers'] = options.nwalkers
+    kwargs['nprocesses'] = options.nprocesses
+    kwargs['sampler'] = options.sampler
+    kwargs['nlive'] = options.nlive
+    kwargs['pmparin_preliminaries'] = options.prelimpmpars
+    kwargs['outdir'] = options.outdir
+    exec("kwargs['shares'] = %s" % options.shares)
+    exec("kwargs['a1dot_constraints'] = %s" % options.a1dot_constraints)
+    print(kwargs)
 
-if clearoutdir:
-    print('\ndeleting old files inside %s now.\n' % kwargs['outdir'])
-    os.system('rm -rf %s/*' % kwargs['outdir'])
+    if clearoutdir:
+        print('\ndeleting old files inside %s now.\n' % kwargs['outdir'])
+        os.system('rm -rf %s/*' % kwargs['outdir'])
 
-simulate.simulate(refepoch, initsfiles, *pmparins, **kwargs)
+    simulate.simulate(refepoch, initsfiles, *pmparins, **kwargs)
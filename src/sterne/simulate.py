@@ -8,12 +8,20 @@ from astropy.time import Time
 import numpy as np
 import astropy.units as u
 from astropy import constants
-import os, sys
+import os
+from functools import lru_cache
 import others
 from astropy.table import Table
 from sterne.model import kopeikin_effects
-from model.positions import positions, filter_dictionary_of_parameter_with_index
+from model.positions import positions, filter_dictionary_of_parameter_with_index, calculate_position_invariants,\
+    parameter_names_of_pmparin
 from sterne import priors as _priors
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError: ## numba is optional; the kernels below then run as plain numpy
+    HAVE_NUMBA = False
+
 def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
     """
     Input parameters
@@ -39,9 +47,9 @@ def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
 
     args : str(s)
         1) to provide extra pmparin files and parfiles.
-        2) the order of args should be either pmparin1, parfile1, pmparin2, parfile2,....
+        2) the order of args should be pmparin1, parfile1, pmparin2, parfile2,....
         3) an example for two pulsars in a globular cluster: 
-        4) an arg both containing '.pmpar.in' and ending with '.par' should be avoided. 
+        4) each pmparin should contain '.pmpar.in', and each parfile should end with '.par' or be ''.
     kwargs : key=value
         1) shares : 2-D array 
             (default : [list(range(N)),[0]*N,[0]*N,[0]*N,[0]*N,[0]*N,[0]*N,list(range(N))]) 
@@ -55,11 +63,13 @@ def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
             parameter[i] with pmparins[j] is turned off. This turn-off function is not so
             useful now, but may be helpful in future.
         2) iterations : float (default : 200)
-            'iterations' that will be passed to bilby.run_sampler().
+            'iterations' that will be passed to bilby.run_sampler() for the 'emcee', 'kombine'
+            and 'zeus' samplers (ignored by other samplers).
             Changing "iterations" to over 500 would avoid fuzzy corner plots, while
             "interations"=1000 would make smooth corner plots.
         3) nwalkers : float (default : 30)
-            'nwalkers' that will be passed to bilby.run_sampler().
+            'nwalkers' that will be passed to bilby.run_sampler() for the 'emcee', 'kombine'
+            and 'zeus' samplers (ignored by other samplers).
         4) outdir : float
             'outdir' that will be passed to run_sampler().
         5) use_saved_samples : bool
@@ -76,6 +86,31 @@ def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
             The error is corrected following the relation:
             errs_new**2 = errs_random**2 + (efac * errs_sys)**2, where errs_random and errs_sys
             stand for random errors and systematic errors, respectively.
+        8) nprocesses : int (default : 1)
+            Number of processes used to evaluate the likelihood of the walkers in parallel.
+            It is passed to bilby.run_sampler() as 'npool'. When nprocesses > 1, the script
+            calling simulate() should be guarded by "if __name__ == '__main__':", and
+            OMP_NUM_THREADS=1 is recommended to be set in the shell beforehand, so that
+            the processes do not compete for the BLAS threads.
+        9) sampler : str (default : 'emcee')
+            The sampler that will be passed to bilby.run_sampler(). Besides 'emcee', nested
+            samplers such as 'dynesty' and 'ultranest' can be used, which handle posteriors with
+            strong parameter covariances better. 'iterations' and 'nwalkers' only apply to 'emcee',
+            'kombine' and 'zeus'; other samplers (e.g. 'ptemcee') run with bilby's defaults for them.
+            JAX-based samplers (e.g. numpyro's AIES) cannot be used, as the position model relies 
+            on astropy and the novas ephemeris, which cannot be traced by JAX.
+        10) plot_corner : bool (default : True)
+            If False, the corner plot made with result.plot_corner() is skipped, which saves
+            considerable time for batch or headless runs.
+        11) pool : pool object (default : None)
+            A user-made pool (e.g. multiprocessing.Pool(n) or schwimmbad.MPIPool()) with a map()
+            method, which is passed to bilby.run_sampler() to evaluate the likelihood of the
+            walkers in parallel. If provided, nprocesses is ignored. The pool is not closed
+            by simulate().
+        12) nlive : int (default : 300)
+            The number of live points, passed to bilby.run_sampler() when a nested sampler
+            (e.g. 'dynesty', 'ultranest' or 'nestle') is used. A few hundred live points normally 
+            suffice for the astrometric fits, at far fewer likelihood evaluations than emcee.
 
     Caveats
     -------
@@ -99,29 +134,8 @@ def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
     ##############################################################
     ############ parse args to get pmparins, parfiles ############
     ##############################################################
-    if not os.path.exists(initsfile):
-        print('%s does not exist; aborting' % initsfile)
-        sys.exit()
-    args = list(args)
-    args.reverse()
-    args.append(parfile)
-    args.append(pmparin)
-    args.reverse() #put the major pmparin at first
-    pmparins, parfiles = [], []
-    for arg in args:
-        if ('.pmpar.in' in arg) and arg.endswith('.par'):
-            print('arg does not follow naming convention,\
-                please follow the docstring! Aborting.')
-            sys.exit()
-        elif '.pmpar.in' in arg:
-            pmparins.append(arg)
-        elif arg.endswith('.par') or arg=='':
-            parfiles.append(arg)
+    pmparins, parfiles = parse_simulate_args(initsfile, pmparin, parfile, *args)
     NoP = len(pmparins)
-    if NoP != len(parfiles):
-        print('Unequal number of parfiles provided for pmparins.\
-            See the docstring for more info. Aborting now.')
-        sys.exit()
 
     ##############################################################
     #####################  parse kwargs  #########################
@@ -150,27 +164,39 @@ def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
         nwalkers = kwargs['nwalkers']
     except KeyError:
         nwalkers = 30
+    try:
+        nprocesses = kwargs['nprocesses']
+    except KeyError:
+        nprocesses = 1
+    try:
+        sampler = kwargs['sampler']
+    except KeyError:
+        sampler = 'emcee'
+    try:
+        plot_corner = kwargs['plot_corner']
+    except KeyError:
+        plot_corner = True
+    try:
+        pool = kwargs['pool']
+    except KeyError:
+        pool = None
+    try:
+        nlive = kwargs['nlive']
+    except KeyError:
+        nlive = 300
 
     try:
         a1dot_constraints = kwargs['a1dot_constraints']
     except KeyError:
         a1dot_constraints = False
 
-    try:
-        pmparin_preliminaries = kwargs['pmparin_preliminaries']
-        if len(pmparin_preliminaries) != NoP:
-            print('The number of pmpar.in.preliminary files has to\
-                match that of pmpar.in files. Exiting for now.')
-            sys.exit(1)
-    except KeyError:
-        pmparin_preliminaries = None
+    pmparin_preliminaries = kwargs.get('pmparin_preliminaries', None) ## checked in create_list_of_dict_VLBI()
+    if pmparin_preliminaries == None:
         shares[1] = [-1] * NoP ## turn off efac inference
     ##############################################################
     #################  get two list_of_dict ######################
     ##############################################################
-    list_of_dict_timing = create_list_of_dict_timing(parfiles)
-
-    list_of_dict_VLBI = create_list_of_dict_VLBI(pmparins, pmparin_preliminaries)
+    list_of_dict_VLBI, list_of_dict_timing = load_inputs(pmparins, parfiles, pmparin_preliminaries)
 
     
     ##############################################################
@@ -185,21 +211,93 @@ def simulate(refepoch, initsfile, pmparin, parfile, *args, **kwargs):
         likelihood = Gaussianlikelihood(refepoch, list_of_dict_timing, list_of_dict_VLBI,\
             shares, positions, DoD_additional_constraints, a1dot_constraints)
 
+        sampler_kwargs = {}
+        if sampler in WALKER_SAMPLERS:
+            sampler_kwargs['nwalkers'] = nwalkers
+            sampler_kwargs['iterations'] = iterations
+        elif sampler in NESTED_SAMPLERS:
+            sampler_kwargs['nlive'] = nlive
+        if pool != None: ## parallelize over the walkers with the provided pool instead of npool
+            sampler_kwargs['pool'] = pool
+            nprocesses = None
         result = bilby.run_sampler(likelihood=likelihood, priors=priors,\
-            sampler='emcee', nwalkers=nwalkers, iterations=iterations, outdir=outdir)
+            sampler=sampler, outdir=outdir, npool=nprocesses, **sampler_kwargs)
     jsonfile = outdir + '/label_result.json' 
     result = bilby.result.read_in_result(filename=jsonfile) 
     result.save_posterior_samples(filename=saved_posteriors)
     make_a_summary_of_bayesian_inference(saved_posteriors, refepoch,\
         list_of_dict_VLBI, list_of_dict_timing)
-    result.plot_corner() ## this may fail when run in the background, therefore put in the last
+    if plot_corner:
+        result.plot_corner() ## this may fail when run in the background, therefore put in the last
+
+class SimulateInputError(ValueError):
+    """
+    Raised when the inputs of simulate() are inconsistent, so that a calling script can
+    recover from it instead of the whole process being exited.
+    """
+    pass
+
+def parse_simulate_args(initsfile, pmparin, parfile, *args):
+    """
+    Checks the positional arguments of simulate() and splits them into pmparins and parfiles.
+    The result is cached until initsfile is modified.
+
+    Return parameters
+    -----------------
+    pmparins : list of str
+    parfiles : list of str
+        Each parfile is either '' or ends with '.par'.
+    """
+    if not os.path.exists(initsfile):
+        raise SimulateInputError('%s does not exist.' % initsfile)
+    all_args = (pmparin, parfile, *args) #the major pmparin comes first
+    pmparins, parfiles = _parse_simulate_args_cached(initsfile, os.path.getmtime(initsfile), all_args)
+    return list(pmparins), list(parfiles)
+
+@lru_cache(maxsize=None)
+def _parse_simulate_args_cached(initsfile, mtime, all_args):
+    """
+    initsfile and mtime are only used as part of the cache key.
+    """
+    if len(all_args) % 2 != 0:
+        raise SimulateInputError('Unequal number of parfiles provided for pmparins. See the docstring for more info.')
+    pmparins, parfiles = all_args[0::2], all_args[1::2]
+    for each_pmparin, each_parfile in zip(pmparins, parfiles):
+        if (not '.pmpar.in' in each_pmparin) or not (each_parfile.endswith('.par') or each_parfile==''):
+            raise SimulateInputError('%s and %s do not follow the pmparin, parfile order or naming convention, '\
+                'please follow the docstring!' % (each_pmparin, each_parfile))
+    return pmparins, parfiles
+
+## samplers of bilby that take the number of walkers and steps as 'nwalkers' and 'iterations'
+WALKER_SAMPLERS = ['emcee', 'kombine', 'zeus']
+## samplers of bilby that take the number of live points as 'nlive'
+NESTED_SAMPLERS = ['dynesty', 'dynamic_dynesty', 'nestle', 'ultranest', 'pymultinest', 'nessai']
+
+def load_inputs(pmparins, parfiles, pmparin_preliminaries=None):
+    """
+    Parse the pmparins and parfiles once; the results can be shared by generate_initsfile()
+    (as the kwarg list_of_dict_VLBI) and Gaussianlikelihood.
+
+    Return parameters
+    -----------------
+    list_of_dict_VLBI : list of dict
+        See create_list_of_dict_VLBI().
+    list_of_dict_timing : list of dict
+        See create_list_of_dict_timing().
+    """
+    list_of_dict_timing = create_list_of_dict_timing(parfiles)
+    list_of_dict_VLBI = create_list_of_dict_VLBI(pmparins, pmparin_preliminaries)
+    return list_of_dict_VLBI, list_of_dict_timing
 
 def create_list_of_dict_timing(parfiles):
     from model import reflex_motion
     list_of_dict_timing = []
+    dict_of_parsed_parfiles = {} ## pmparins sharing a parfile (e.g. in-beam calibrators) parse it once
     for parfile in parfiles:
         if parfile != '':
-            dict_of_timing_parameters = reflex_motion.read_parfile(parfile)
+            if not parfile in dict_of_parsed_parfiles:
+                dict_of_parsed_parfiles[parfile] = reflex_motion.read_parfile(parfile)
+            dict_of_timing_parameters = dict_of_parsed_parfiles[parfile]
         else:
             dict_of_timing_parameters = {}
         list_of_dict_timing.append(dict_of_timing_parameters)
@@ -214,7 +312,7 @@ def create_list_of_dict_VLBI(pmparins, pmparin_preliminaries=None):
         t = readpmparin(pmparin)
         radecs = np.concatenate([t['RA'], t['DEC']])
         errs = np.concatenate([t['errRA'], t['errDEC']])
-        epochs = np.array(t['epoch'])
+        epochs = np.asarray(t['epoch']) ## t is discarded, no copy needed
         dictionary = {}
         dictionary['epochs'] = epochs
         dictionary['radecs'] = radecs
@@ -222,18 +320,16 @@ def create_list_of_dict_VLBI(pmparins, pmparin_preliminaries=None):
         list_of_dict_VLBI.append(dictionary)
     if pmparin_preliminaries != None:
         if len(pmparin_preliminaries) != NoP:
-            print('The number of pmpar.in.preliminary files has to\
-                match that of pmpar.in files. Exiting for now.')
-            sys.exit(1)
+            raise SimulateInputError('%d pmpar.in.preliminary files are provided for %d pmpar.in files; '\
+                'the two numbers have to match.' % (len(pmparin_preliminaries), NoP))
         for i in range(NoP):
             t = readpmparin(pmparin_preliminaries[i])
-            if not (np.array(t['epoch']) == list_of_dict_VLBI[i]['epochs']).all():
-                print('Epochs of the pmpar.in.preliminary files should match those of the pmpar.in files; exiting for now.')
-                sys.exit(1)
+            if not np.array_equal(np.asarray(t['epoch']), list_of_dict_VLBI[i]['epochs']):
+                raise SimulateInputError('Epochs of %s do not match those of %s.' % (pmparin_preliminaries[i], pmparins[i]))
             errs_random = np.concatenate([t['errRA'], t['errDEC']])
             list_of_dict_VLBI[i]['errs_random'] = errs_random
             errs = list_of_dict_VLBI[i]['errs']
-            errs_sys = (errs**2 - errs_random**2)**0.5
+            errs_sys = np.sqrt(np.maximum(errs*errs - errs_random*errs_random, 0.)) ## np.maximum avoids NaN from rounding when errs==errs_random
             list_of_dict_VLBI[i]['errs_sys'] = errs_sys
     print(list_of_dict_VLBI)
     return list_of_dict_VLBI
@@ -274,10 +370,11 @@ def make_a_brief_summary_of_Bayesian_inference(samplefile):
     ## >>> estimate correlation coefficients
     DoR = dict_of_correlation_coefficient = {}
     writefile.write('\n#Correlation coefficients:\n')
+    correlation_matrix = np.corrcoef(np.vstack([np.asarray(t[p]) for p in parameters])) ## all pairs in one pass
     for i in range(1, len(parameters)):
         for j in range(i):
             key = 'r__' + parameters[j] + '__' + parameters[i]
-            DoR[key] = np.corrcoef(t[parameters[j]], t[parameters[i]])[0,1]
+            DoR[key] = correlation_matrix[j,i]
             writefile.write('%s = %f\n' % (key, DoR[key]))
     #print(DoR)
     ## <<<
@@ -287,29 +384,70 @@ def make_a_brief_summary_of_Bayesian_inference(samplefile):
 
 def calculate_reduced_chi_square(refepoch, list_of_dict_VLBI, list_of_dict_timing, dict_median):
     LoD_VLBI, LoD_timing = list_of_dict_VLBI, list_of_dict_timing
-    chi_sq = 0
-    NoO = number_of_observations = 0
-    for i in range(len(LoD_VLBI)):
-        res = LoD_VLBI[i]['radecs'] - positions(refepoch, LoD_VLBI[i]['epochs'], LoD_timing[i], i, dict_median)
-        errs_new = adjust_errs_with_efac(LoD_VLBI[i], dict_median, i)
-        chi_sq += np.sum((res/errs_new)**2) #if both RA and errRA are weighted by cos(DEC), the weighting is canceled out
-        NoO += 2 * len(LoD_VLBI[i]['epochs'])
+    ## concatenate the residuals and errors of all pmparins, then reduce them in one go
+    res = np.concatenate([LoD_VLBI[i]['radecs'] - positions(refepoch, LoD_VLBI[i]['epochs'], LoD_timing[i], i, dict_median)\
+        for i in range(len(LoD_VLBI))])
+    errs_new_sq = np.concatenate([adjust_errs_sq_with_efac(LoD_VLBI[i], dict_median, i) for i in range(len(LoD_VLBI))])
+    chi_sq = _chi2(res, 1. / errs_new_sq) #if both RA and errRA are weighted by cos(DEC), the weighting is canceled out
+    NoO = number_of_observations = len(res)
     DoF = degree_of_freedom = NoO - len(dict_median)
     rchsq = chi_sq / DoF
     return chi_sq, rchsq
 
-def adjust_errs_with_efac(VLBI_dict, parameters_dict, parameter_filter_index):
+def adjust_errs_sq_with_efac(VLBI_dict, parameters_dict, parameter_filter_index):
+    efac_key = find_efac_key(parameters_dict, parameter_filter_index)
+    if efac_key != None:
+        efac = parameters_dict[efac_key]
+    else:
+        efac = -999
+    return calculate_errs_sq_with_efac(VLBI_dict, efac)
+
+def find_efac_key(parameters_dict, parameter_filter_index):
+    """
+    Return parameters
+    -----------------
+    efac_key : str or None
+        Name of the efac parameter for the pmparin indexed by parameter_filter_index;
+        None if efac is not inferred for this pmparin.
+    """
     FP = filter_dictionary_of_parameter_with_index(parameters_dict, parameter_filter_index)
     Ps = list(FP.keys())
     Ps.sort()
-    efac = FP[Ps[1]]
+    if Ps[1] in parameters_dict:
+        return Ps[1]
+    else: ## auto-filled by filter_dictionary_of_parameter_with_index
+        return None
+
+def calculate_errs_sq_with_efac(VLBI_dict, efac):
+    """
+    Return parameters
+    -----------------
+    errs_new_sq : array of float
+        Squares of the EFAC-adjusted errors (the square root is never needed by the likelihood).
+    """
     if efac != -999: 
         errs_new_sq = (VLBI_dict['errs_random'])**2 + (efac * VLBI_dict['errs_sys'])**2
     else: ## if efac is not to be inferred
         errs_new_sq = VLBI_dict['errs']**2
-    return errs_new_sq**0.5
-
+    return errs_new_sq
 
+if HAVE_NUMBA:
+    @njit(cache=True, fastmath=True)
+    def _chi2(res, inv_errs_sq):
+        """
+        chi-square of the residuals res given the inverse squared errors inv_errs_sq.
+        The square, multiplication and sum are fused into one (SIMD-vectorized) pass without temporaries.
+        """
+        chi_sq = 0.
+        for j in range(res.shape[0]):
+            chi_sq += res[j] * res[j] * inv_errs_sq[j]
+        return chi_sq
+else:
+    def _chi2(res, inv_errs_sq):
+        """
+        chi-square of the residuals res given the inverse squared errors inv_errs_sq.
+        """
+        return np.dot(res, res*inv_errs_sq) ## one temporary, reduced by BLAS
 
 
 class Gaussianlikelihood(bilby.Likelihood):
@@ -329,11 +467,38 @@ class Gaussianlikelihood(bilby.Likelihood):
         self.positions = positions
         self.shares = shares
         self.number_of_pmparins = len(self.LoD_VLBI)
+        ## >>> pack the positions of all pmparins into one contiguous float64 array;
+        ## the positions of pmparin i are self._radecs[self._slices[i]]
+        lengths = [len(d['radecs']) for d in self.LoD_VLBI]
+        boundaries = np.cumsum([0] + lengths)
+        self._slices = [slice(boundaries[i], boundaries[i+1]) for i in range(self.number_of_pmparins)]
+        self._radecs = np.concatenate([d['radecs'] for d in self.LoD_VLBI]).astype(np.float64)
+        self._epochs = [np.ascontiguousarray(d['epochs'], dtype=np.float64) for d in self.LoD_VLBI]
+        ## <<<
+        ## scratch buffers re-used by every log_likelihood call
+        self._model_radecs = np.empty_like(self._radecs)
+        self._res = np.empty_like(self._radecs)
+        self._errs_new_sq = np.empty_like(self._radecs)
+        ## trigger the numba compilation (or cache load) here, before the sampler forks its workers,
+        ## rather than in the first log_likelihood call of every worker
+        _chi2(self._radecs, np.ones_like(self._radecs))
+        ## the parameter-independent part of the model (ephemerides, orbital phases, etc.), computed once
+        self._position_invariants = [calculate_position_invariants(self.refepoch, self._epochs[i],\
+            self.LoD_timing[i]) for i in range(self.number_of_pmparins)]
+        ## >>> when efac is not inferred for any pmparin, errs_new never changes; cache it
+        if all(share < 0 for share in self.shares[1]):
+            self._fixed_errs_sq = np.concatenate([d['errs'] for d in self.LoD_VLBI]).astype(np.float64)**2
+            self._fixed_log_sum_errs = 0.5 * np.sum(np.log(self._fixed_errs_sq))
+            self._fixed_inv_errs_sq = 1. / self._fixed_errs_sq ## multiply, rather than divide, in every call
+        else:
+            self._fixed_errs_sq = None
+        ## <<<
         #self.pmparin_preliminaries = pmparin_preliminaries
         self.dict_sin_incl_Gaussian_constraints = DoD_additional_constraints['sin_incl_Gaussian_constraints'] 
         
         if a1dot_constraints != False:
             self.a1dot_constraints, self.a1dot_mus, self.a1dot_sigmas = self.parse_a1dot_constraints(a1dot_constraints)
+            self._a1dot_inv_sigmas_sq = 1. / self.a1dot_sigmas**2
         else:
             self.a1dot_constraints = False
         '''
@@ -345,6 +510,26 @@ class Gaussianlikelihood(bilby.Likelihood):
 
         parameters = _priors.get_parameters_from_shares(self.shares)
         print(parameters)
+        ## efac parameter names are resolved once here rather than in every log_likelihood call
+        self._efac_keys = [find_efac_key(parameters, i) for i in range(self.number_of_pmparins)]
+        ## likewise for the names of the astrometric parameters of each pmparin
+        self._parameter_names = [parameter_names_of_pmparin(parameters, i) for i in range(self.number_of_pmparins)]
+        if self._fixed_errs_sq is None:
+            ## >>> errs_new_sq = r2 + efac**2 * s2 over all pmparins at once, where r2 = errs_random**2
+            ## and s2 = errs_sys**2 (for pmparins without efac, r2 = errs**2 and s2 = 0)
+            r2, s2 = [], []
+            for i in range(self.number_of_pmparins):
+                d = self.LoD_VLBI[i]
+                if self._efac_keys[i] != None:
+                    r2.append(np.asarray(d['errs_random'], dtype=np.float64)**2)
+                    s2.append(np.asarray(d['errs_sys'], dtype=np.float64)**2)
+                else:
+                    r2.append(np.asarray(d['errs'], dtype=np.float64)**2)
+                    s2.append(np.zeros(len(d['errs'])))
+            self._errs_random_sq = np.concatenate(r2)
+            self._errs_sys_sq = np.concatenate(s2)
+            self._lengths = lengths
+            ## <<<
         super().__init__(parameters)
 
         
@@ -353,18 +538,29 @@ class Gaussianlikelihood(bilby.Likelihood):
         """
         the name has to be log_likelihood, and the PDF has to do the log calculation.
         """
-        log_p = 0
+        model_radecs = self._model_radecs
         for i in range(self.number_of_pmparins):
-            res = self.LoD_VLBI[i]['radecs'] - self.positions(self.refepoch, self.LoD_VLBI[i]['epochs'], self.LoD_timing[i], i, self.parameters)
-            errs_new = adjust_errs_with_efac(self.LoD_VLBI[i], self.parameters, i) 
-            log_p += -0.5 * np.sum((res/errs_new)**2) ##if both RA and errRA are weighted by cos(DEC), the weighting is canceled out
-            log_p += -1 * np.sum(np.log(errs_new))
+            model_radecs[self._slices[i]] = self.positions(self.refepoch, self._epochs[i],\
+                self.LoD_timing[i], i, self.parameters, self._position_invariants[i], self._parameter_names[i])
+        res = np.subtract(self._radecs, model_radecs, out=self._res) ##if both RA and errRA are weighted by cos(DEC), the weighting is canceled out
+        if not np.isfinite(res).all(): ## the proposed parameters are beyond what the model can handle
+            return -np.inf
+        if self._fixed_errs_sq is not None:
+            inv_errs_sq = self._fixed_inv_errs_sq
+            log_sum_errs = self._fixed_log_sum_errs
+        else:
+            efacs_sq = np.repeat(self._efacs_sq(), self._lengths)
+            errs_new_sq = np.multiply(efacs_sq, self._errs_sys_sq, out=self._errs_new_sq)
+            errs_new_sq += self._errs_random_sq
+            log_sum_errs = 0.5 * np.sum(np.log(errs_new_sq))
+            inv_errs_sq = np.reciprocal(errs_new_sq, out=errs_new_sq)
         
-        if self.a1dot_constraints:
+        if self.a1dot_constraints: ## a1dot residuals join the same chi-square as the positions
             modeled_a1dots = kopeikin_effects.calculate_a1dot_pm(self.LoD_timing, self.parameters)
             #print('ETRA=%.20f' % ETRA)
-            res_a1dots = modeled_a1dots - self.a1dot_mus
-            log_p += -0.5 * np.sum((res_a1dots / self.a1dot_sigmas)**2)
+            res = np.concatenate([res, modeled_a1dots - self.a1dot_mus])
+            inv_errs_sq = np.concatenate([inv_errs_sq, self._a1dot_inv_sigmas_sq])
+        log_p = -0.5 * _chi2(res, inv_errs_sq) - log_sum_errs
 
         if len(self.dict_sin_incl_Gaussian_constraints) != 0:
             for parameter in self.dict_sin_incl_Gaussian_constraints:
@@ -374,15 +570,17 @@ class Gaussianlikelihood(bilby.Likelihood):
         return log_p
     
 
+    def _efacs_sq(self):
+        """
+        Squared efac of each pmparin (0 where efac is not inferred).
+        """
+        return np.array([self.parameters[key]**2 if key != None else 0. for key in self._efac_keys])
+
     def parse_a1dot_constraints(self, a1dot_constraints):
-        a1dot_mus = np.array([])
-        a1dot_sigmas = np.array([])
-        for a1dot_constraint in a1dot_constraints:
-            if len(a1dot_constraint) == 2:
-                a1dot_mu, a1dot_sigma = a1dot_constraint
-                a1dot_mus = np.append(a1dot_mus, a1dot_mu)
-                a1dot_sigmas = np.append(a1dot_sigmas, a1dot_sigma)
-        if len(a1dot_mus) == 0:
+        pairs = [a1dot_constraint for a1dot_constraint in a1dot_constraints if len(a1dot_constraint) == 2]
+        a1dot_mus = np.asarray([pair[0] for pair in pairs], dtype=float)
+        a1dot_sigmas = np.asarray([pair[1] for pair in pairs], dtype=float)
+        if len(pairs) == 0:
             a1dot_constraints = False
         else:
             a1dot_constraints = True
@@ -448,41 +646,41 @@ def dms2rad(ra, dec):
 
 def readpmparin(pmparin):
     """
+    The parsed table is cached until pmparin is modified; a copy is returned each time.
     """
-    epochs = RAs = errRAs = DECs = errDECs = np.array([])
-    lines = open(pmparin).readlines()
-    for line in lines:
+    return _readpmparin_cached(*others.file_cache_key(pmparin)).copy()
+
+@lru_cache(maxsize=None)
+def _readpmparin_cached(pmparin, mtime_ns, size):
+    """
+    pmparin is the real path of the file; mtime_ns and size are only used as part of the cache key.
+    """
+    with open(pmparin, 'r') as readfile: ## stream the lines; the file is closed on exit
         #if 'epoch' in line and not line.strip().startswith('#'):
         #    refepoch = line.split('=')[1].strip()
-        if line.count(':')==4 and (not line.strip().startswith('#')): 
-            epoch, RA, errRA, DEC, errDEC = line.strip().split(' ')
-            epoch = decyear2mjd(float(epoch.strip())) #in MJD
-            DEC = others.dms2deg(DEC.strip()) #in deg
-            DEC *= np.pi/180. #in rad
-            RA = others.dms2deg(RA.strip()) #in hr
-            RA *= 15*np.pi/180. #in rad
-            errRA = float(errRA.strip()) #in s
-            errRA *= 15 * np.pi/180./3600. #in rad
-            errDEC = float(errDEC.strip()) #in arcsecond
-            errDEC *= np.pi/180./3600 #in rad
-
-            epochs = np.append(epochs, epoch)
-            RAs = np.append(RAs, RA)
-            DECs = np.append(DECs, DEC)
-            errRAs = np.append(errRAs, errRA)
-            errDECs = np.append(errDECs, errDEC)
+        data_lines = (line for line in readfile if line.count(':')==4 and (not line.strip().startswith('#')))
+        ## the data rows are split by numpy's C parser, then whole columns are converted
+        rows = np.loadtxt(data_lines, dtype=str, ndmin=2)
+    columns = rows.reshape(-1, 5).T
+    epochs = decyear2mjd(columns[0].astype(float)) #in MJD
+    RAs = others.dms2deg_vec(columns[1]) * (15*np.pi/180.) #hr to rad
+    errRAs = columns[2].astype(float) * (15*np.pi/180./3600.) #s to rad
+    DECs = others.dms2deg_vec(columns[3]) * (np.pi/180.) #deg to rad
+    errDECs = columns[4].astype(float) * (np.pi/180./3600) #arcsecond to rad
     t = Table([epochs, RAs, errRAs, DECs, errDECs], names=['epoch', 'RA', 'errRA', 'DEC', 'errDEC'])
     t.sort('epoch')
     return t
 
-def decyear2mjd(epoch):
+def decyear2mjd(epochs):
     """
+    Converts an array of epochs to MJD in one Time call; epochs larger than the threshold
+    are taken to be in MJD already.
     """
     threshold = 10000
-    if epoch > threshold:
-        return epoch
-    else:
-        decyear = Time(epoch, format='decimalyear')
-        MJD = float(format(decyear.mjd))
-        return MJD
+    epochs = np.asarray(epochs, dtype=float)
+    MJDs = epochs.copy()
+    decyear_indice = epochs <= threshold
+    if decyear_indice.any(): ## pmparins given entirely in MJD need no Time object at all
+        MJDs[decyear_indice] = Time(epochs[decyear_indice], format='decimalyear').mjd
+    return MJDs
 